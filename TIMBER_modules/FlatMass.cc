@@ -1,6 +1,8 @@
 #include "../include/common.h"
 #include "ROOT/RVec.hxx"
 #include "TH1F.h"
+#include <atomic>
+#include <vector>
 
 #ifndef M_PI
 #define M_PI 3.14159
@@ -11,28 +13,47 @@ using namespace ROOT::VecOps;
 class MassFlattener {
 // This class provides a method to select jets based on flat mass criteria.
 public:
-    MassFlattener(float mass_max = 250.) : mass_max(mass_max), histogram("jet_histogram", "Jet Mass Histogram", static_cast<int>(mass_max / 5), 0, mass_max) {
+    MassFlattener(float mass_max = 250.) : mass_max(mass_max), n_bins(static_cast<int>(mass_max / 5)), bin_width(mass_max / n_bins), bin_counts(n_bins) {
     }
 
-    RVec<int> SelectJetsFlatMass(RVec<float> FatJet_pt, RVec<float> FatJet_eta, RVec<float> FatJet_msoftdrop, float ptCut, float etaCut, float massCut, int max_count) {
-        RVec<int> selectedJets;
+    // Returns a per-jet mask (1 = selected) of the same length as the FatJet collection
+    RVec<int> SelectJetsFlatMassMask(const RVec<float>& FatJet_pt, const RVec<float>& FatJet_eta, const RVec<float>& FatJet_msoftdrop, float ptCut, float etaCut, float massCut, int max_count) {
+        RVec<int> selectedJets(FatJet_pt.size(), 0);
+        const float etaCut2 = etaCut * etaCut; // compare eta^2 instead of |eta|
         for (size_t i = 0; i < FatJet_pt.size(); ++i) {
-            if (FatJet_pt[i] > ptCut && std::abs(FatJet_eta[i]) < etaCut && FatJet_msoftdrop[i] > massCut) {
+            if (FatJet_pt[i] > ptCut && FatJet_eta[i] * FatJet_eta[i] < etaCut2 && FatJet_msoftdrop[i] > massCut) {
                 float mass = FatJet_msoftdrop[i];
-                int bin = histogram.FindBin(mass);
-                
-                if (bin <= histogram.GetNbinsX() && histogram.GetBinContent(bin) >= max_count) {
-                    continue; // Skip if bin count exceeds max_count, jets with mass > mass_max will be accepted as we assume they will have lower counts due to the falling spectrum
+                int bin = static_cast<int>(mass / bin_width); // uniform bins, no bin search needed
+                if (bin < 0) {
+                    continue; // only reachable with massCut < -bin_width, keeps the index in range
                 }
-                
-                selectedJets.push_back(i);
-                histogram.Fill(mass);
+                if (bin >= n_bins) {
+                    selectedJets[i] = 1; // jets with mass > mass_max are accepted as we assume they will have lower counts due to the falling spectrum
+                    continue;
+                }
+
+                selectedJets[i] = TryIncrement(bin_counts[bin], max_count);
             }
         }
         return selectedJets;
     }
 
+    // Increments count only while it is below max_count, lock-free so ImplicitMT threads do not serialize on the shared counts
+    static int TryIncrement(std::atomic<int>& count, int max_count) {
+        int current = count.load(std::memory_order_relaxed);
+        while (current < max_count) {
+            if (count.compare_exchange_weak(current, current + 1, std::memory_order_relaxed)) {
+                return 1;
+            }
+        }
+        return 0;
+    }
+
     void SaveHistogram(const std::string& filename) {
+        TH1F histogram("jet_histogram", "Jet Mass Histogram", n_bins, 0, mass_max);
+        for (int bin = 0; bin < n_bins; ++bin) {
+            histogram.SetBinContent(bin + 1, bin_counts[bin].load());
+        }
         TFile file(filename.c_str(), "RECREATE");
         histogram.Write();
         file.Close();
@@ -40,5 +61,23 @@ public:
 
 private:
     float mass_max; // Preferably divisible with 5 because of assumed binning size of 5 GeV
-    TH1F histogram;
-};
\ No newline at end of file
+    int n_bins;
+    float bin_width;
+    std::vector<std::atomic<int>> bin_counts; // accepted jets per mass bin, zero-initialized
+};
+
+// Single MassFlattener instance shared by all events, a new instance per event would not keep the bin counts.
+// Reached through free functions instead of an interpreter global, function-local statics are initialized thread-safely.
+MassFlattener& SharedMassFlattener() {
+    static MassFlattener mass_flattener;
+    return mass_flattener;
+}
+
+RVec<int> FlatMassSelectJetsMask(const RVec<float>& FatJet_pt, const RVec<float>& FatJet_eta, const RVec<float>& FatJet_msoftdrop, float ptCut, float etaCut, float massCut, int max_count) {
+    return SharedMassFlattener().SelectJetsFlatMassMask(FatJet_pt, FatJet_eta, FatJet_msoftdrop, ptCut, etaCut, massCut, max_count);
+}
+
+// Writes the accepted-jet counts of the shared instance, call after the event loop has run
+void FlatMassSaveHistogram(const std::string& filename) {
+    SharedMassFlattener().SaveHistogram(filename);
+}
\ No newline at end of file
@@ -4,7 +4,7 @@ Merge individual .h5 files on EOS into one .h5 file per sample.
 If 3 arguments are given, the second is treated as a single sample name to process. Otherwise, all subdirectories under the specified EOS path are processed.
 
   1. Copies all .h5 chunk files locally using `xrdcp`
-  2. Creates a new merged .h5 file by appending datasets from all chunks
+  2. Creates a new merged .h5 file with pre-sized datasets and writes each chunk into its slice
   3. Cleans up local temporary files
   4. Uploads the merged file back to EOS as: <sample_name>.h5 (in the STORE_DATABASE_PATH directory)
 
@@ -14,7 +14,10 @@ Usage:
 import os
 import sys
 import subprocess
+from contextlib import ExitStack
+from multiprocessing import Pool
 import h5py
+import numpy as np
 
 # Get path from first argument, or show usage
 if len(sys.argv) < 2:
@@ -25,6 +28,10 @@ STORE_DATABASE_PATH = sys.argv[1]
 SINGLE_SAMPLE = sys.argv[2] if len(sys.argv) > 2 else None
 LOCAL_WORKDIR    = "/tmp/h5_merge_work"
 
+CHUNK_BYTES = 1024 * 1024  # target size of one chunk in the merged datasets
+H5_CHUNK_CACHE_BYTES = 128 * 1024 * 1024  # chunk cache of the merged file, the default is 1 MB
+MAX_PARALLEL_MERGES = 2  # every sample in flight keeps its chunks and merged copy in LOCAL_WORKDIR, keep /tmp usage bounded
+
 EOS_CMD    = "eos"
 XRDCP_CMD  = "xrdcp"
 RDR_PREFIX = "root://cmseos.fnal.gov/"
@@ -47,106 +54,145 @@ def xrdcp_out(local, remote):
     cmd = [XRDCP_CMD, "-f", local, f"{RDR_PREFIX}{remote}"]
     subprocess.check_call(cmd)
 
-os.makedirs(LOCAL_WORKDIR, exist_ok=True)
-
-if SINGLE_SAMPLE:
-    samples = [SINGLE_SAMPLE]
-else:
-    samples = [s for s in eos_ls(STORE_DATABASE_PATH) if not s.endswith('.h5')]
 
-for sample in samples:
-    sample_dir = f"{STORE_DATABASE_PATH}/{sample}"
+def chunk_shape(n_rows, entry_shape, dtype):
+    """Chunk of ~CHUNK_BYTES along the first axis, not longer than the dataset."""
+    row_bytes = dtype.itemsize * int(np.prod(entry_shape))
+    rows_per_chunk = max(1, min(CHUNK_BYTES // row_bytes, n_rows))
+    return (rows_per_chunk, *entry_shape)
 
-    try:
-        existing = set(eos_ls(STORE_DATABASE_PATH))
-    except subprocess.CalledProcessError:
-        existing = set()
 
-    # gather H5 files in this folder
-    try:
-        files = [f for f in eos_ls(sample_dir) if f.endswith('.h5')]
-    except subprocess.CalledProcessError:
-        continue
-    if not files:
-        continue
+def merge_one(sample, files):
+    """Merge the downloaded chunk files of one sample and upload the result."""
+    sample_dir = f"{STORE_DATABASE_PATH}/{sample}"
+    # separate work area per sample, chunk file names can repeat between samples
+    workdir = os.path.join(LOCAL_WORKDIR, sample)
+    os.makedirs(workdir, exist_ok=True)
 
     merged_name   = f"{sample}.h5"
-    local_merged  = os.path.join(LOCAL_WORKDIR, merged_name)
+    local_merged  = os.path.join(workdir, merged_name)
     remote_merged = f"{STORE_DATABASE_PATH}/{merged_name}"
 
-    # ask before overwriting an existing merged file
-    if merged_name in existing:
-        ans = input(f"Merged file '{merged_name}' already exists in {sample_dir}. Overwrite? [y/N]: ")
-        if ans.strip().lower() != 'y':
-            print(f"[skip] {merged_name} not overwritten")
-            continue
-        else:
-            print(f"[recreate] Overwriting existing merged file for {sample}")
-
     # remove stale local merge if any
     if os.path.exists(local_merged):
         os.remove(local_merged)
 
     print(f"[start] {sample}: merging {len(files)} files")
-    dataset_paths = []
+    local_files = []
 
-    for idx, fname in enumerate(files):
+    for fname in files:
         remote_file = f"{sample_dir}/{fname}"
-        local_file  = os.path.join(LOCAL_WORKDIR, fname)
+        local_file  = os.path.join(workdir, fname)
 
         print(f"[download] {remote_file}")
         xrdcp_in(remote_file, local_file)
+        local_files.append(local_file)
 
-    print(f"[start] {sample}: merging {len(files)} files")
-    dataset_paths = []
-
-    for idx, fname in enumerate(files):
-        remote_file = f"{sample_dir}/{fname}"
-        local_file  = os.path.join(LOCAL_WORKDIR, fname)
-
-        print(f"[download] {remote_file}")
-        xrdcp_in(remote_file, local_file)
+    # open every input once and keep it open for both the schema check and the copy
+    with ExitStack() as stack:
+        inputs = [stack.enter_context(h5py.File(local_file, 'r')) for local_file in local_files]
 
-        # On first file, collect all dataset paths and initialize merged file
-        if idx == 0:
-            with h5py.File(local_file, 'r') as f0:
-                # traverse to collect dataset paths
-                f0.visititems(lambda path, obj: dataset_paths.append(path) if isinstance(obj, h5py.Dataset) else None)
-                # create merged file structure
-                with h5py.File(local_merged, 'w') as fout:
-                    for path in dataset_paths:
-                        ds0 = f0[path]
-                        # ensure parent groups exist
-                        parent = os.path.dirname(path)
-                        if parent:
-                            fout.require_group(parent)
-                        # create resizable dataset
-                        shape_tail = ds0.shape[1:]
-                        fout.create_dataset(
-                            path,
-                            shape=(0, *shape_tail),
-                            maxshape=(None, *shape_tail),
-                            chunks=True,
-                            dtype=ds0.dtype
-                        )
-
-        # append data for each dataset
-        with h5py.File(local_file, 'r') as fin, h5py.File(local_merged, 'a') as fout:
-            # verify same schema
+        # collect dataset paths and the total number of rows of each dataset
+        dataset_paths = []
+        total_rows = {}
+        for idx, fin in enumerate(inputs):
             cur_paths = []
             fin.visititems(lambda path, obj: cur_paths.append(path) if isinstance(obj, h5py.Dataset) else None)
-            if set(cur_paths) != set(dataset_paths):
-                raise RuntimeError(f"Schema mismatch in {local_file}")
+            if idx == 0:
+                dataset_paths = cur_paths
+            # verify same schema
+            elif set(cur_paths) != set(dataset_paths):
+                raise RuntimeError(f"Schema mismatch in {fin.filename}")
             for path in dataset_paths:
-                data = fin[path][...]
-                ds = fout[path]
-                old = ds.shape[0]
-                ds.resize((old + data.shape[0], *data.shape[1:]))
-                ds[old:] = data
+                total_rows[path] = total_rows.get(path, 0) + fin[path].shape[0]
 
+        with h5py.File(local_merged, 'w', rdcc_nbytes=H5_CHUNK_CACHE_BYTES, rdcc_nslots=1_000_003) as fout:
+            # create merged file structure with the final dataset sizes, so no resizing is needed
+            f0 = inputs[0]
+            for path in dataset_paths:
+                ds0 = f0[path]
+                # ensure parent groups exist
+                parent = os.path.dirname(path)
+                if parent:
+                    fout.require_group(parent)
+                entry_shape = ds0.shape[1:]
+                fout.create_dataset(
+                    path,
+                    shape=(total_rows[path], *entry_shape),
+                    maxshape=(None, *entry_shape),  # only so that an empty dataset can still be chunked
+                    chunks=chunk_shape(total_rows[path], entry_shape, ds0.dtype),
+                    compression="lzf",
+                    shuffle=True,
+                    dtype=ds0.dtype
+                )
+
+            # write data of each file into its row slice
+            offsets = {path: 0 for path in dataset_paths}
+            for fin in inputs:
+                for path in dataset_paths:
+                    data = fin[path][...]
+                    n = data.shape[0]
+                    if n == 0:
+                        continue
+                    # single hyperslab write, skips h5py's __setitem__ selection handling
+                    fout[path].write_direct(data, dest_sel=np.s_[offsets[path]:offsets[path] + n])
+                    offsets[path] += n
+
+    for local_file in local_files:
         os.remove(local_file)
 
     print(f"[upload] {local_merged} -> {remote_merged}")
     xrdcp_out(local_merged, remote_merged)
     os.remove(local_merged)
     print(f"[done] {sample}\n")
+
+
+def main():
+    os.makedirs(LOCAL_WORKDIR, exist_ok=True)
+
+    if SINGLE_SAMPLE:
+        samples = [SINGLE_SAMPLE]
+    else:
+        samples = [s for s in eos_ls(STORE_DATABASE_PATH) if not s.endswith('.h5')]
+
+    try:
+        existing = set(eos_ls(STORE_DATABASE_PATH))
+    except subprocess.CalledProcessError:
+        existing = set()
+
+    # decide what to merge up front, so that prompts are not interleaved with the parallel merges
+    to_merge = []
+    for sample in samples:
+        sample_dir = f"{STORE_DATABASE_PATH}/{sample}"
+
+        # gather H5 files in this folder
+        try:
+            files = [f for f in eos_ls(sample_dir) if f.endswith('.h5')]
+        except subprocess.CalledProcessError:
+            continue
+        if not files:
+            continue
+
+        merged_name = f"{sample}.h5"
+
+        # ask before overwriting an existing merged file
+        if merged_name in existing:
+            ans = input(f"Merged file '{merged_name}' already exists in {sample_dir}. Overwrite? [y/N]: ")
+            if ans.strip().lower() != 'y':
+                print(f"[skip] {merged_name} not overwritten")
+                continue
+            else:
+                print(f"[recreate] Overwriting existing merged file for {sample}")
+
+        to_merge.append((sample, files))
+
+    if not to_merge:
+        return
+
+    # samples are independent, merge a few of them in separate processes
+    with Pool(min(len(to_merge), MAX_PARALLEL_MERGES, os.cpu_count())) as pool:
+        pool.starmap(merge_one, to_merge)
+
+
+if __name__ == "__main__":
+    main()
@@ -153,7 +153,8 @@ echo "Job processing chunk ${CHUNK_FILE} completed at $(date)"
     script_path = Path("job.sh")
     if flat_mass:
         script_content = script_content.replace("selection.py", "selection_flat_mass.py")
-        script_content = script_content.replace("${process_name}", "")
+        # selection_flat_mass.py takes no process name, every argument before the output file is an input
+        script_content = script_content.replace(' "${process_name}"', "")
 
     with open(script_path, 'w') as f:
         f.write(script_content)
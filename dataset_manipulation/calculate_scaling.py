@@ -31,9 +31,8 @@ def calculate_scaling(input_file, output_file, key="Jets", max_jets=None):
         n_jets = len(jets) if max_jets is None else min(len(jets), max_jets)
         print(f"Using {n_jets} jets for scaling calculation")
         
-        # Get feature dimension from first jet
-        first_jet = jets[0]['hidNeurons'][:]
-        n_features = len(first_jet)
+        # Get feature dimension from the dtype
+        n_features = jets.dtype['hidNeurons'].shape[0]
         print(f"Number of features: {n_features}")
         
         # Calculate mean and std incrementally to avoid memory issues
@@ -47,13 +46,8 @@ def calculate_scaling(input_file, output_file, key="Jets", max_jets=None):
             start_idx = batch_idx * batch_size
             end_idx = min(start_idx + batch_size, n_jets)
             
-            # Load batch
-            batch_features = []
-            for i in range(start_idx, end_idx):
-                features = jets[i]['hidNeurons'][:].astype(np.float64)
-                batch_features.append(features)
-            
-            batch_features = np.array(batch_features)
+            # Load batch, reading only the hidNeurons field of the compound records
+            batch_features = jets.fields('hidNeurons')[start_idx:end_idx].astype(np.float64)
             
             # Update running statistics
             running_sum += batch_features.sum(axis=0)
@@ -24,7 +24,7 @@ def get_dataset_entries(config_path, dataset_prefix, output_dir):
 def get_jet_pts(h5_path):
     """Load jet pt array from h5 file."""
     with h5py.File(h5_path, "r") as f:
-        pts = f["Jets"]["pt"][:]
+        pts = f["Jets"].fields("pt")[()]
     return pts
 
 def get_all_columns(h5_path):
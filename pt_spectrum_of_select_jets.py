@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
 import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import h5py
 import numpy as np
 import matplotlib.pyplot as plt
@@ -32,24 +34,43 @@ files_signal = [
 ]
  
 # 100 bins from 0 to 2000 GeV
-bin_edges = np.linspace(150, 800, 65)
+# float32 edges match the stored pt dtype so binning stays in single precision
+bin_edges = np.linspace(150, 800, 65, dtype=np.float32)
+
+# Histograms only depend on the input file and the binning, cache them to skip re-reading the h5 files
+HIST_CACHE_DIR = ".histcache"
+
+def pt_histogram(path, bin_edges):
+    cache_key = hashlib.md5((path + str(os.path.getmtime(path)) + str(bin_edges.tobytes())).encode()).hexdigest()
+    cache_path = os.path.join(HIST_CACHE_DIR, f"{cache_key}.npz")
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            return cached["counts"]
+    with h5py.File(path, 'r') as f:
+        pt = f['Jets'].fields('pt')[()].astype(np.float32, copy=False)
+    counts, _ = np.histogram(pt, bins=bin_edges)
+    os.makedirs(HIST_CACHE_DIR, exist_ok=True)
+    np.savez_compressed(cache_path, counts=counts, bin_edges=bin_edges)
+    return counts
 
 # ─── LOAD & HISTOGRAM ───────────────────────────────────────────────────
+# Check all inputs up front, stats on NFS are slow so run them in parallel
+paths = [info['path'] for info in files_QCD + files_signal]
+with ThreadPoolExecutor() as pool:
+    missing = [p for p, ok in zip(paths, pool.map(os.path.exists, paths)) if not ok]
+if missing:
+    raise FileNotFoundError(f"Files not found: {missing}")
+
 hist_data_QCD = []
 for info in files_QCD:
-    if not os.path.exists(info['path']):
-        raise FileNotFoundError(f"File not found: {info['path']}")
-    with h5py.File(info['path'], 'r') as f:
-        jets = f['Jets'] 
-        pt = jets['pt'][:]
-        counts, _ = np.histogram(pt, bins=bin_edges)
-        n_jets = counts.sum()
-        #We are scaling xsec by number of jets, it is not perfect but looks good enough for now
-        #Once we store the number of processed events, this will have to be changed
-        scale = info['xsec'] / n_jets if n_jets > 0 else 0.0
-        scaled_counts = counts * scale
-        hist_data_QCD.append((scaled_counts, info['label']))
-        print(f"{info['label']}: {n_jets:,} jets -> scale = {scale:.3e}")
+    counts = pt_histogram(info['path'], bin_edges)
+    n_jets = counts.sum()
+    #We are scaling xsec by number of jets, it is not perfect but looks good enough for now
+    #Once we store the number of processed events, this will have to be changed
+    scale = info['xsec'] / n_jets if n_jets > 0 else 0.0
+    scaled_counts = counts * scale
+    hist_data_QCD.append((scaled_counts, info['label']))
+    print(f"{info['label']}: {n_jets:,} jets -> scale = {scale:.3e}")
 
 # ─── PLOTTING QCD──────────────────────────────────────────────────────────
 fig, ax = plt.subplots()
@@ -61,19 +82,16 @@ hep.histplot([h[0] for h in hist_data_QCD], bins=bin_edges, histtype="fill", lab
 # ─── PLOTTING SIG──────────────────────────────────────────────────────────
 
 for info in files_signal:
-    with h5py.File(info['path'], 'r') as f:
-        jets = f['Jets']
-        pt = jets['pt'][:]
-        counts, _ = np.histogram(pt, bins=bin_edges)
-        hep.histplot(
-            counts,
-            bins=bin_edges,
-            histtype="step",
-            label=info['label'],
-            ax=ax,
-            linewidth=2,
-            density=True
-        )
+    counts = pt_histogram(info['path'], bin_edges)
+    hep.histplot(
+        counts,
+        bins=bin_edges,
+        histtype="step",
+        label=info['label'],
+        ax=ax,
+        linewidth=2,
+        density=True
+    )
 
 # Axis labels
 ax.set_xlabel(r"$p_{T}^{\mathrm{jet}}\;[\mathrm{GeV}]$")
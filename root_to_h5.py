@@ -1,16 +1,83 @@
 import uproot
+import awkward as ak
 import numpy as np
 import h5py
+import os
 import time
 import sys
 
 MAX_EVENTS = -1  # limit events for debugging (-1 to disable)
 N_HIDDEN_LAYERS = 256
-
-def bunch_neuron_branches(tree, prefix, n_hidden, entry_stop=None):
-    branch_names = [f"{prefix}_globalParT3_hidNeuron{i:03d}" for i in range(n_hidden)]
-    arrays = tree.arrays(branch_names, entry_stop=entry_stop, library="np")
-    return arrays, branch_names
+STEP_SIZE = "100 MB"  # size of the event batches read from the ROOT file
+N_THREADS = int(os.environ.get("OMP_NUM_THREADS", os.cpu_count()))  # Condor sets OMP_NUM_THREADS to request_cpus
+H5_CHUNK_CACHE_BYTES = 256 * 1024 * 1024  # keep the chunks being filled resident instead of the 1 MB default
+
+# Output field -> input branch
+JET_BRANCHES = {
+    "pt": "SelectedFatJet_pt",
+    "eta": "SelectedFatJet_eta",
+    "phi": "SelectedFatJet_phi",
+    "mass": "SelectedFatJet_msoftdrop",
+    "globalParT3_QCD": "SelectedFatJet_globalParT3_QCD",
+    "globalParT3_TopbWqq": "SelectedFatJet_globalParT3_TopbWqq",
+    "globalParT3_TopbWq": "SelectedFatJet_globalParT3_TopbWq",
+    "particleNet_QCD0HF": "SelectedFatJet_particleNet_QCD0HF",
+    "particleNet_QCD1HF": "SelectedFatJet_particleNet_QCD1HF",
+    "particleNet_QCD2HF": "SelectedFatJet_particleNet_QCD2HF",
+}
+# Optional fields are set to -1 when the branch is not in the input
+OPTIONAL_JET_BRANCHES = {
+    "top_category": "SelectedFatJet_top_cat",
+    "hadron_flavour": "SelectedFatJet_hadronFlavour",
+}
+
+# Define compound dtype for HDF5 dataset
+JET_DTYPE = np.dtype([
+    ("pt", np.float32),
+    ("eta", np.float32),
+    ("phi", np.float32),
+    ("mass", np.float32),
+    ("hidNeurons", np.float16, (N_HIDDEN_LAYERS,)),  # half precision is enough for training features
+    ("top_category", np.int32),
+    ("hadron_flavour", np.int32),
+    ("particleNet_QCD0HF", np.float32),
+    ("particleNet_QCD1HF", np.float32),
+    ("particleNet_QCD2HF", np.float32),
+    ("globalParT3_QCD", np.float32),
+    ("globalParT3_TopbWqq", np.float32),
+    ("globalParT3_TopbWq", np.float32)
+])
+CHUNK_JETS = max(1, 1_048_576 // JET_DTYPE.itemsize)  # ~1 MB chunks on disk
+
+def bunch_neuron_branches(prefix, n_hidden):
+    return [f"{prefix}_globalParT3_hidNeuron{i:03d}" for i in range(n_hidden)]
+
+def process_batch(batch, neuron_branch_names):
+    # Flatten one batch of events into a structured array of jets
+    n_jets = int(ak.sum(ak.num(batch["SelectedFatJet_pt"])))
+    jets_array = np.empty(n_jets, dtype=JET_DTYPE)  # every field is assigned below
+
+    # Fill each field in one shot from the flattened jagged arrays
+    for field, branch in JET_BRANCHES.items():
+        jets_array[field] = ak.to_numpy(ak.flatten(batch[branch]))
+    for field, branch in OPTIONAL_JET_BRANCHES.items():
+        if branch in batch.fields:
+            jets_array[field] = ak.to_numpy(ak.flatten(batch[branch]))
+        else:
+            jets_array[field].fill(-1)
+
+    # Stack neurons into [n_jets, n_neurons], the float16 cast happens while copying into the record field
+    jets_array["hidNeurons"] = np.stack([ak.to_numpy(ak.flatten(batch[name])) for name in neuron_branch_names], axis=1)
+
+    return jets_array
+
+def append_jets(dataset, jets_array):
+    n_jets = len(jets_array)
+    if n_jets == 0:
+        return
+    old = dataset.shape[0]
+    dataset.resize(old + n_jets, axis=0)
+    dataset[old:] = jets_array
 
 def main(input_file, output_file):
     start_time = time.time()
@@ -18,115 +85,29 @@ def main(input_file, output_file):
         tree = f["Events"]
 
         # Limit events if debugging
-        n_events_total = len(tree["SelectedFatJet_pt"].array())
+        n_events_total = tree.num_entries
         n_events = n_events_total if MAX_EVENTS < 0 else min(MAX_EVENTS, n_events_total)
 
-        # Load jet-level info
-        FatJet_pt = tree["SelectedFatJet_pt"].array(entry_stop=n_events)
-        FatJet_eta = tree["SelectedFatJet_eta"].array(entry_stop=n_events)
-        FatJet_phi = tree["SelectedFatJet_phi"].array(entry_stop=n_events)
-        FatJet_mass = tree["SelectedFatJet_msoftdrop"].array(entry_stop=n_events)
-        FatJet_globalParT3_QCD = tree["SelectedFatJet_globalParT3_QCD"].array(entry_stop=n_events)
-        FatJet_globalParT3_TopbWqq = tree["SelectedFatJet_globalParT3_TopbWqq"].array(entry_stop=n_events)
-        FatJet_globalParT3_TopbWq = tree["SelectedFatJet_globalParT3_TopbWq"].array(entry_stop=n_events)
-        FatJet_particleNet_QCD0HF = tree["SelectedFatJet_particleNet_QCD0HF"].array(entry_stop=n_events)
-        FatJet_particleNet_QCD1HF = tree["SelectedFatJet_particleNet_QCD1HF"].array(entry_stop=n_events)
-        FatJet_particleNet_QCD2HF = tree["SelectedFatJet_particleNet_QCD2HF"].array(entry_stop=n_events)
-        
         # Optional branches
-        FatJet_top_cat = None
-        FatJet_hadronFlavour = None
-        if "SelectedFatJet_top_cat" in tree.keys():
-            FatJet_top_cat = tree["SelectedFatJet_top_cat"].array(entry_stop=n_events)
-        if "SelectedFatJet_hadronFlavour" in tree.keys():
-            FatJet_hadronFlavour = tree["SelectedFatJet_hadronFlavour"].array(entry_stop=n_events)
+        optional_branches = [b for b in OPTIONAL_JET_BRANCHES.values() if b in tree.keys()]
 
+        # Neurons for jets [n_events, n_jets, n_neurons]
+        neuron_branch_names = bunch_neuron_branches("SelectedFatJet", N_HIDDEN_LAYERS)
 
+        branches = list(JET_BRANCHES.values()) + optional_branches + neuron_branch_names
 
-        # Get neurons for jets [n_events, n_jets, n_neurons]
-        FatJet_neurons, neuron_branch_names = bunch_neuron_branches(tree, "SelectedFatJet", N_HIDDEN_LAYERS, entry_stop=n_events)        
-        
-        # Flatten jets across events
-        jets_list = []
-        jet_counter = 0
-        total_jets = sum(len(jets) for jets in FatJet_pt)
+        # Basket decompression is the heavy part of reading, spread it over threads (the codecs release the GIL)
+        # Flattening a batch is cheap next to decompressing it, so batches are processed inline as they are read
+        with uproot.ThreadPoolExecutor(N_THREADS) as decompression_executor, h5py.File(output_file, "w", libver="latest", rdcc_nbytes=H5_CHUNK_CACHE_BYTES, rdcc_nslots=1_000_003) as hf:
+            jets_ds = hf.create_dataset("Jets", shape=(0,), maxshape=(None,), chunks=(CHUNK_JETS,), compression="lzf", shuffle=True, dtype=JET_DTYPE)
+            for batch in tree.iterate(branches, entry_stop=n_events, step_size=STEP_SIZE, library="ak", decompression_executor=decompression_executor):
+                append_jets(jets_ds, process_batch(batch, neuron_branch_names))
+            total_jets = jets_ds.shape[0]
 
         print(f"Total jets in {n_events} events: {total_jets}")
 
-        for ev in range(n_events):
-            n_jets = len(FatJet_pt[ev])
-            for jet_i in range(n_jets):
-                if jet_counter >= total_jets:
-                    break
-
-                top_category = FatJet_top_cat[ev][jet_i] if FatJet_top_cat is not None else -1
-                hadron_flavour = FatJet_hadronFlavour[ev][jet_i] if FatJet_hadronFlavour is not None else -1
-                particleNet_QCD0HF = FatJet_particleNet_QCD0HF[ev][jet_i]
-                particleNet_QCD1HF = FatJet_particleNet_QCD1HF[ev][jet_i]
-                particleNet_QCD2HF = FatJet_particleNet_QCD2HF[ev][jet_i]
-                fatjet_info = (
-                    FatJet_pt[ev][jet_i],
-                    FatJet_eta[ev][jet_i],
-                    FatJet_phi[ev][jet_i],
-                    FatJet_mass[ev][jet_i],
-                    top_category,
-                    hadron_flavour,
-                    particleNet_QCD0HF,
-                    particleNet_QCD1HF,
-                    particleNet_QCD2HF,
-                    FatJet_globalParT3_QCD[ev][jet_i],
-                    FatJet_globalParT3_TopbWqq[ev][jet_i],
-                    FatJet_globalParT3_TopbWq[ev][jet_i],
-                )
-
-                neurons = np.array([FatJet_neurons[name][ev][jet_i] for name in neuron_branch_names])
-                jets_list.append((fatjet_info, neurons))
-
-                jet_counter += 1
-            if jet_counter >= total_jets:
-                break
-
-        print(f"Processed {jet_counter}/{total_jets} jets")
-
-        # Define compound dtype for HDF5 dataset
-        dtype = np.dtype([
-            ("pt", np.float32),
-            ("eta", np.float32),
-            ("phi", np.float32),
-            ("mass", np.float32),
-            ("hidNeurons", np.float32, (N_HIDDEN_LAYERS,)),
-            ("top_category", np.int32),
-            ("hadron_flavour", np.int32),
-            ("particleNet_QCD0HF", np.float32),
-            ("particleNet_QCD1HF", np.float32),
-            ("particleNet_QCD2HF", np.float32),
-            ("globalParT3_QCD", np.float32),
-            ("globalParT3_TopbWqq", np.float32),
-            ("globalParT3_TopbWq", np.float32)
-        ])
-
-        jets_array = np.zeros(len(jets_list), dtype=dtype)
-
-        for i, (fatjet_info, neurons) in enumerate(jets_list):
-            jets_array[i]["pt"] = fatjet_info[0]
-            jets_array[i]["eta"] = fatjet_info[1]
-            jets_array[i]["phi"] = fatjet_info[2]
-            jets_array[i]["mass"] = fatjet_info[3]
-            jets_array[i]["top_category"] = fatjet_info[4]
-            jets_array[i]["hadron_flavour"] = fatjet_info[5]
-            jets_array[i]["particleNet_QCD0HF"] = fatjet_info[6]
-            jets_array[i]["particleNet_QCD1HF"] = fatjet_info[7]
-            jets_array[i]["particleNet_QCD2HF"] = fatjet_info[8]
-            jets_array[i]["globalParT3_QCD"] = fatjet_info[9]
-            jets_array[i]["globalParT3_TopbWqq"] = fatjet_info[10]
-            jets_array[i]["globalParT3_TopbWq"] = fatjet_info[11]
-            jets_array[i]["hidNeurons"] = neurons
-
-        with h5py.File(output_file, "w") as hf:
-            hf.create_dataset("Jets", data=jets_array)
-
     elapsed = time.time() - start_time
-    print(f"Saved {len(jets_list)} jets to {output_file} in {elapsed:.1f}s ({elapsed/len(jets_list):.3f} jet/s)")
+    print(f"Saved {total_jets} jets to {output_file} in {elapsed:.1f}s ({elapsed/total_jets:.3f} jet/s)")
 
     with h5py.File(output_file, "r") as hf:
         print_h5_structure(hf)
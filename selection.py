@@ -1,6 +1,6 @@
 from TIMBER.Analyzer import *
 from TIMBER.Tools.Common import *
-import ROOT,sys
+import ROOT,sys,os
 
 sys.path.append('../../')
 
@@ -84,6 +84,10 @@ else:
     do_match = False
 
 
+# Run the event loop on all available cores, Condor sets OMP_NUM_THREADS to request_cpus
+# Must be enabled before the RDataFrame is created
+ROOT.EnableImplicitMT(int(os.environ.get("OMP_NUM_THREADS", os.cpu_count())))
+
 # Import the C++
 CompileCpp('TIMBER/Framework/include/common.h')
 CompileCpp('TIMBER_modules/JetMatching.cc')
@@ -96,8 +100,7 @@ ptCut = default_cuts["pt_min"]
 massCut = default_cuts["mass_min"]
 
 myCuts = CutGroup('myCuts')
-a.Cut('njet',        'nFatJet>0')
-a.Cut('pt_cut',      f'FatJet_pt[0] > {ptCut}')#Ordered in pT so we can apply cut on first jet
+a.Cut('pt_cut',      f'nFatJet>0 && FatJet_pt[0] > {ptCut}')#Ordered in pT so we can apply cut on first jet, && short-circuits on events without jets
 
 if do_match:
     # Returns indices of jets matched to gen particles of given pdgid(s) within deltaR
@@ -1,6 +1,6 @@
 from TIMBER.Analyzer import *
 from TIMBER.Tools.Common import *
-import ROOT, sys
+import ROOT, sys, os
 
 ROOT.gROOT.SetBatch(True)
 
@@ -16,59 +16,55 @@ default_cuts = {
     'deltaR_max': 0.8  # For DeltaR matching
 }
 
-def get_max_count(input_file, cuts):
-    # Get histogram of jet mass after cuts and return max count in 5 GeV bins between 245 and 250 GeV
-    f = ROOT.TFile(input_file)
-    tree = f.Get('Events')
-    hist = ROOT.TH1F('temp_hist', '', 100, 0, 500)
+def get_max_count(df, cuts):
+    # Return number of jets passing cuts in the 245--250 GeV mass bin, used as max count in 5 GeV bins
+    # The count is needed by the flattening selection itself, so it has to be filled in its own event loop before it
     pt_cut = cuts['pt_min']
     eta_cut = cuts['abs_eta_max']
     mass_cut = cuts['mass_min']
-    tree.Draw('FatJet_msoftdrop>>temp_hist', f"FatJet_pt>{pt_cut} && abs(FatJet_eta)<{eta_cut} && FatJet_msoftdrop>{mass_cut}")
-    count = 0
-    for i in range(1, hist.GetNbinsX() + 1):
-        bin_center = hist.GetBinCenter(i)
-        if 245 <= bin_center < 250:
-            count = hist.GetBinContent(i)
-    f.Close()
-    return count
+    df = df.Define('n_jets_in_bin', f"Sum(FatJet_pt>{pt_cut} && FatJet_eta*FatJet_eta<{eta_cut*eta_cut} && FatJet_msoftdrop>{mass_cut} && FatJet_msoftdrop>=245 && FatJet_msoftdrop<250)")
+    return int(df.Sum('n_jets_in_bin').GetValue())
 
 if len(sys.argv) < 3:
-    print("Usage: python selection.py input_file.root output_file.root")
+    print("Usage: python selection_flat_mass.py input_file.root [input_file2.root ...] output_file.root")
     sys.exit(1)
 
-input_file = sys.argv[1]
-output_file = sys.argv[2]
+input_files = sys.argv[1:-1]
+output_file = sys.argv[-1]
+
+# Run the event loops on all available cores, Condor sets OMP_NUM_THREADS to request_cpus
+# Must be enabled before any RDataFrame is created
+ROOT.EnableImplicitMT(int(os.environ.get("OMP_NUM_THREADS", os.cpu_count())))
 
 CompileCpp('TIMBER/Framework/include/common.h')
 CompileCpp('TIMBER_modules/FlatMass.cc')
 
-a = analyzer(input_file)
+# TIMBER chains all inputs into one RDataFrame, so the max count, JIT and event loop are shared across files
+a = analyzer(input_files)
 
 etaCut = default_cuts["abs_eta_max"]
 ptCut = default_cuts["pt_min"]
 massCut = default_cuts["mass_min"]
 
-max_count = get_max_count(input_file, default_cuts)
+# Count on the analyzer's own (still uncut) RDataFrame, so the input is not opened a second time
+max_count = get_max_count(a.GetActiveNode().DataFrame, default_cuts)
 print(f"Jet count in 245-250 GeV mSD bin: {max_count}")
 
-# Create a single instance of MassFlattener
-# Using a.Define(massFlattener, "MassFlattener()") would create a new instance for each event, which we do not want!
-ROOT.gInterpreter.ProcessLine("MassFlattener mass_flattener;")
-
 myCuts = CutGroup('myCuts')
-a.Cut('njet', 'nFatJet>0')
-a.Cut('pt_cut', f'FatJet_pt[0] > {ptCut}')  # Ordered in pT so we can apply cut on first jet
+a.Cut('pt_cut', f'nFatJet>0 && FatJet_pt[0] > {ptCut}')  # Ordered in pT so we can apply cut on first jet, && short-circuits on events without jets
 
-# Use the MassFlattener instance to define selected_jet_indices
-a.Define("selected_jet_indices", f"mass_flattener.SelectJetsFlatMass(FatJet_pt, FatJet_eta, FatJet_msoftdrop, {ptCut}, {etaCut}, {massCut}, {max_count})")
+# FlatMassSelectJetsMask uses a single MassFlattener instance shared by all events
+a.Define("selected_jet_mask", f"FlatMassSelectJetsMask(FatJet_pt, FatJet_eta, FatJet_msoftdrop, {ptCut}, {etaCut}, {massCut}, {max_count})")
 
 # Remove events without jets to avoid crashing
-a.Cut("has_selected_jets", "selected_jet_indices.size() > 0")
+a.Cut("has_selected_jets", "Any(selected_jet_mask)")
 
 keep_list = ["pt", "phi", "eta", "msoftdrop", "globalParT3_hidNeuron", "globalParT3_QCD", "globalParT3_TopbWqq", "globalParT3_TopbWq", "hadronFlavour", "particleNet_QCD"]
 
-a.SubCollection("SelectedFatJet", "FatJet", 'selected_jet_indices', useTake=True, keep=keep_list)
+# Boolean-mask compaction instead of an index gather, the selected jets keep their pT ordering either way
+a.SubCollection("SelectedFatJet", "FatJet", 'selected_jet_mask', useTake=False, keep=keep_list)
 
-out_vars = ['nSelectedFatJet', 'SelectedFatJet*', 'SelectedFatJet_globalParT3*']
+# Single anchored pattern, TIMBER joins the list with '|' and RDataFrame only anchors the ends of the joined regex,
+# an unanchored alternative would also match SubCollection's FatJet_SelectedFatJet_bitmask
+out_vars = ['^(nSelectedFatJet|SelectedFatJet_.*)$']
 a.GetActiveNode().Snapshot(out_vars, output_file, 'Events', lazy=False, openOption='RECREATE')
\ No newline at end of file